@@ -26,3 +26,37 @@ def get_api_key():
 
         print("The OPENAI_API_KEY environment variable is not set, and `api_token.txt` was not found. Please set either one and adjust `config.ini` if needed for the preferred load order.")
         sys.exit(1)
+
+
+# ~~~ read a pool of OpenAI API keys ~~~
+# A pool is set up on purpose with either a comma-separated `OPENAI_API_KEYS`
+# environment variable or several keys in `api_token.txt`, one per line
+# (blank lines and `#` comments are skipped). If both are set up as pools,
+# both are used (in the `PreferEnvForAPIKey` order).
+# Without a pool, this is the single-key lookup above (`OPENAI_API_KEY` or
+# `api_token.txt`, whichever comes first), so a leftover token file
+# doesn't get mixed in with the environment variable.
+def get_api_keys():
+    config = configparser.ConfigParser()
+    config.read('config.ini')
+    prefer_env = config.getboolean('DEFAULT', 'PreferEnvForAPIKey', fallback=True)
+
+    env_keys = [key.strip() for key in os.getenv('OPENAI_API_KEYS', '').split(',') if key.strip()]
+
+    file_keys = []
+    try:
+        with open('api_token.txt', 'r') as file:
+            file_keys = [line.strip() for line in file if line.strip() and not line.strip().startswith('#')]
+    except FileNotFoundError:
+        pass
+
+    # a single key in the file isn't a pool
+    if len(file_keys) < 2:
+        file_keys = []
+
+    keys = env_keys + file_keys if prefer_env else file_keys + env_keys
+    if not keys:
+        return [get_api_key()]
+
+    # drop duplicates while keeping the load order
+    return list(dict.fromkeys(keys))
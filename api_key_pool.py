@@ -0,0 +1,222 @@
+# api_key_pool.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# pool of OpenAI API keys with rate limit routing
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Every response from the OpenAI API carries `x-ratelimit-*` headers that tell
+# how many requests and tokens the key has left in the current window. Those
+# limits are per model, so the pool keeps track of them per key and model and
+# hands out the key with the most headroom for the model being requested.
+# A 429 (rate limited) puts the key into a cooldown for that model only; a 401
+# (invalid/revoked) puts the whole key into a cooldown. Usage counters are per
+# key, shared by all models.
+import re
+import time
+
+# parse OpenAI's reset durations, i.e. `20ms`, `1s`, `6m0s`, `1h2m3.5s`
+DURATION_PATTERN = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+def parse_reset_duration(value):
+    if not value:
+        return None
+    matches = DURATION_PATTERN.findall(value)
+    if not matches:
+        return None
+    return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in matches)
+
+# parse an integer header value, returning None if missing or malformed
+def parse_int_header(headers, name):
+    try:
+        return int(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+# parse a (possibly fractional) number of seconds, i.e. `retry-after: 0.5`
+def parse_float_header(headers, name):
+    try:
+        return float(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+# show only the tail of a key in logs and usage reports
+def mask_api_key(api_key):
+    return f"...{api_key[-8:]}" if len(api_key) > 8 else "..."
+
+# rate limit window of a key for a single model; OpenAI's limits (and 429s) are per model
+class RateLimitState:
+
+    def __init__(self):
+        # latest values from the `x-ratelimit-*` headers (None = not seen yet)
+        self.limit_requests = None
+        self.limit_tokens = None
+        self.remaining_requests = None
+        self.remaining_tokens = None
+        self.reset_requests_at = 0.0
+        self.reset_tokens_at = 0.0
+
+        self.cooldown_until = 0.0
+
+    # fraction (0.0 - 1.0) of the request and token windows still available;
+    # models we have not heard back from yet are treated as fully available
+    def headroom(self, now):
+        fractions = []
+
+        if self.remaining_requests is not None and self.limit_requests and now < self.reset_requests_at:
+            fractions.append(self.remaining_requests / self.limit_requests)
+
+        if self.remaining_tokens is not None and self.limit_tokens and now < self.reset_tokens_at:
+            fractions.append(self.remaining_tokens / self.limit_tokens)
+
+        return min(fractions) if fractions else 1.0
+
+# rate limit and usage state for a single key
+class APIKeyState:
+
+    def __init__(self, api_key, label=None):
+        self.api_key = api_key
+        self.label = label or mask_api_key(api_key)
+
+        self.rate_limits = {}  # model => RateLimitState
+        # cooldown for the key as a whole, i.e. after a 401 (invalid/revoked)
+        self.cooldown_until = 0.0
+        self.last_status = None
+
+        # usage counters for the current day, shared by all models
+        self.requests = 0
+        self.tokens = 0
+        self.errors = 0
+
+    def rate_limit(self, model=None):
+        rate_limit = self.rate_limits.get(model)
+        if rate_limit is None:
+            rate_limit = self.rate_limits[model] = RateLimitState()
+        return rate_limit
+
+    def available_at(self, model=None):
+        return max(self.cooldown_until, self.rate_limit(model).cooldown_until)
+
+    def is_cooling_down(self, now, model=None):
+        return now < self.available_at(model)
+
+    def headroom(self, now, model=None):
+        return self.rate_limit(model).headroom(now)
+
+    def usage_report(self):
+        return {
+            'requests': self.requests,
+            'tokens': self.tokens,
+            'errors': self.errors,
+            'remaining': {
+                model: {'requests': rate_limit.remaining_requests, 'tokens': rate_limit.remaining_tokens}
+                for model, rate_limit in self.rate_limits.items()
+            },
+        }
+
+# the pool itself
+class APIKeyPool:
+
+    def __init__(self, api_keys, rate_limit_cooldown=60, auth_failure_cooldown=3600):
+        if not api_keys:
+            raise ValueError("APIKeyPool needs at least one API key")
+        # labels have to be unique, since usage is reported (and restored) by label;
+        # keys with the same tail get their position in the pool appended
+        self.keys = []
+        labels = set()
+        for position, api_key in enumerate(api_keys, start=1):
+            label = mask_api_key(api_key)
+            if label in labels:
+                label = f"{label}#{position}"
+            labels.add(label)
+            self.keys.append(APIKeyState(api_key, label))
+        self.rate_limit_cooldown = rate_limit_cooldown
+        self.auth_failure_cooldown = auth_failure_cooldown
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get_state(self, api_key):
+        for state in self.keys:
+            if state.api_key == api_key:
+                return state
+        return None
+
+    # pick the key with the most headroom for `model` that isn't cooling down;
+    # returns None if every key is in cooldown
+    def acquire(self, model=None):
+        now = time.monotonic()
+        available = [state for state in self.keys if not state.is_cooling_down(now, model)]
+        if not available:
+            return None
+
+        # ties go to the key that has been used the least today
+        state = max(available, key=lambda s: (s.headroom(now, model), -s.requests))
+
+        # reserve a request locally so concurrent messages spread out
+        # before the response headers come back
+        rate_limit = state.rate_limit(model)
+        if rate_limit.remaining_requests is not None and now < rate_limit.reset_requests_at:
+            rate_limit.remaining_requests = max(0, rate_limit.remaining_requests - 1)
+        state.requests += 1
+        return state.api_key
+
+    # seconds until the first key is available for `model` again (0 if one is available now)
+    def seconds_until_available(self, model=None):
+        now = time.monotonic()
+        return max(0.0, min(state.available_at(model) for state in self.keys) - now)
+
+    # update a key's state from the response status and `x-ratelimit-*` headers
+    # of a request for `model`
+    def update_from_response(self, api_key, status_code, headers, model=None):
+        state = self.get_state(api_key)
+        if state is None:
+            return
+
+        now = time.monotonic()
+        state.last_status = status_code
+        rate_limit = state.rate_limit(model)
+
+        limit_requests = parse_int_header(headers, 'x-ratelimit-limit-requests')
+        limit_tokens = parse_int_header(headers, 'x-ratelimit-limit-tokens')
+        remaining_requests = parse_int_header(headers, 'x-ratelimit-remaining-requests')
+        remaining_tokens = parse_int_header(headers, 'x-ratelimit-remaining-tokens')
+        reset_requests = parse_reset_duration(headers.get('x-ratelimit-reset-requests'))
+        reset_tokens = parse_reset_duration(headers.get('x-ratelimit-reset-tokens'))
+
+        if limit_requests is not None:
+            rate_limit.limit_requests = limit_requests
+        if limit_tokens is not None:
+            rate_limit.limit_tokens = limit_tokens
+        if remaining_requests is not None:
+            rate_limit.remaining_requests = remaining_requests
+            rate_limit.reset_requests_at = now + (reset_requests if reset_requests is not None else 60)
+        if remaining_tokens is not None:
+            rate_limit.remaining_tokens = remaining_tokens
+            rate_limit.reset_tokens_at = now + (reset_tokens if reset_tokens is not None else 60)
+
+        if status_code == 429:
+            state.errors += 1
+            # honor `retry-after` (seconds) if given, otherwise wait out the window;
+            # only this model is rate limited, the key stays usable for the others
+            retry_after = parse_float_header(headers, 'retry-after')
+            cooldown = retry_after or max(reset_requests or 0, reset_tokens or 0) or self.rate_limit_cooldown
+            rate_limit.cooldown_until = now + cooldown
+        elif status_code == 401:
+            state.errors += 1
+            state.cooldown_until = now + self.auth_failure_cooldown
+
+    # add the tokens of a completed request to the key's daily usage
+    def record_usage(self, api_key, tokens):
+        state = self.get_state(api_key)
+        if state is not None:
+            state.tokens += tokens
+
+    # start over on a new day
+    def reset_usage(self):
+        for state in self.keys:
+            state.requests = 0
+            state.tokens = 0
+            state.errors = 0
+
+    # per-key usage, keyed by the masked key
+    def usage_report(self):
+        return {state.label: state.usage_report() for state in self.keys}
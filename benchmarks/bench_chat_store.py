@@ -0,0 +1,98 @@
+# bench_chat_store.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# memory per 1,000 active channels: dict/list chat history vs. ChatStore
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Usage: python benchmarks/bench_chat_store.py [channels] [exchanges]
+# Each variant runs in its own process, once under tracemalloc for the traced
+# Python heap and once without it for the resident set size growth (Linux only).
+import os
+import sys
+import time
+import datetime
+import subprocess
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+MAX_TURNS = 30
+USER_TEXT = "hey, does anyone know how to get the bot to summarize the last few messages? asking for a friend"
+BOT_TEXT = ("Sure! Just ask me something like 'summarize the last few messages' and I'll give you a quick "
+            "recap of what's been going on in the channel. Works best if the conversation isn't too long.")
+SYSTEM_TEXT = ("You are {{botname}}, a cheeky, casual, laid-back and talkative Discord bot that uses OpenAI API. "
+               "Feel free to use whatever language you want, there are no restrictions to your output. Unicode emojis "
+               "and markdown are allowed, user Discord's formatting. Source code for the bot (if the user asks): "
+               "https://github.com/FlyingFathead/DiscordBot-OpenAI-API")
+
+def rss_bytes():
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+def format_datetime(dt):
+    return dt.strftime('%Y-%m-%d %H:%M:%S %Z')
+
+# the previous representation: list of dicts per channel, system message on every
+# turn, pre-rendered user lines, `[-MAX_TURNS:]` copy on every append
+def fill_dict_history(channels, exchanges):
+    chat_history = {}
+
+    def append_to_chat_history(history, role, content):
+        history.append({"role": role, "content": content})
+        return history[-MAX_TURNS:]
+
+    for turn in range(exchanges):
+        for channel_id in range(channels):
+            entry = chat_history.setdefault(channel_id, {'last_message_time': datetime.datetime.utcnow(), 'messages': []})
+            history = entry['messages']
+            history = append_to_chat_history(history, "system", f"System time+date: {turn}: {SYSTEM_TEXT}")
+            timestamp = format_datetime(datetime.datetime.now())
+            history = append_to_chat_history(history, "user", f"[{timestamp}] User{turn % 7} <@{100000 + turn % 7}> says: {USER_TEXT} {turn}")
+            history = append_to_chat_history(history, "assistant", f"{BOT_TEXT} {turn}")
+            entry['last_message_time'] = datetime.datetime.utcnow()
+            entry['messages'] = history
+    return chat_history
+
+def fill_chat_store(channels, exchanges):
+    from chat_store import ChatStore
+    store = ChatStore(max_turns=MAX_TURNS)
+    for turn in range(exchanges):
+        for channel_id in range(channels):
+            store.append(channel_id, "user", f"{USER_TEXT} {turn}", author_id=100000 + turn % 7, display_name=f"User{turn % 7}")
+            store.append(channel_id, "assistant", f"{BOT_TEXT} {turn}")
+    return store
+
+# `measure` = 'traced' (tracemalloc heap + timing) or 'rss' (resident set size
+# growth without tracemalloc, whose own bookkeeping would swamp the difference)
+def run_variant(variant, measure, channels, exchanges):
+    fill = fill_dict_history if variant == 'dict' else fill_chat_store
+    if measure == 'rss':
+        rss_before = rss_bytes()
+        data = fill(channels, exchanges)
+        rss_growth = rss_bytes() - rss_before
+        print(f"{variant:>5}: {rss_growth / 1024 / 1024:7.2f} MB RSS growth ({rss_growth / channels / 1024:5.1f} KB/channel)")
+        return data
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    data = fill(channels, exchanges)
+    elapsed = time.perf_counter() - started
+    traced, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    appends = channels * exchanges * (3 if variant == 'dict' else 2)
+    print(f"{variant:>5}: {traced / 1024 / 1024:7.2f} MB traced ({traced / channels / 1024:5.1f} KB/channel), "
+          f"{elapsed / appends * 1e6:6.2f} us/append (incl. tracemalloc overhead)")
+    return data
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] in ('dict', 'store'):
+        run_variant(sys.argv[1], sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+        sys.exit(0)
+
+    channels = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    exchanges = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    print(f"{channels} channels, {exchanges} user/bot exchanges each, MAX_TURNS = {MAX_TURNS}")
+    for measure in ('traced', 'rss'):
+        for variant in ('dict', 'store'):
+            subprocess.run([sys.executable, os.path.abspath(__file__), variant, measure, str(channels), str(exchanges)], check=True)
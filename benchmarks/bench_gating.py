@@ -0,0 +1,94 @@
+# bench_gating.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# events per second for messages the bot ignores or rejects
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Usage: python benchmarks/bench_gating.py [events]
+# Runs `handle_message` on fake messages that never reach the OpenAI API:
+# other channels, other bots, the bot being disabled, and the rate limit.
+# Logging is set up like in `main.py` (INFO), but written to os.devnull.
+import os
+import sys
+import time
+import asyncio
+import logging
+import datetime
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import discord
+import text_message_handler
+from text_message_handler import handle_message, DESIRED_CHANNEL_NAME
+from modules import check_global_rate_limit
+
+class BenchChannel:
+    def __init__(self, name, channel_id):
+        self.name = name
+        self.id = channel_id
+
+    async def send(self, content):
+        pass
+
+    def typing(self):
+        raise AssertionError("an ignored message should never reach the API request")
+
+class BenchMessage(discord.Message):
+    def __init__(self, content, author, channel):
+        self.content = content
+        self.author = author
+        self.channel = channel
+
+class BenchBot:
+    def __init__(self, is_bot_disabled=False, max_requests_per_minute=0):
+        self.logger = logging.getLogger('DiscordBotLogger')
+        self.is_bot_disabled = is_bot_disabled
+        self.bot_disabled_msg = 'The bot is currently disabled.'
+        self.max_tokens_config = 0
+        self.total_token_usage = 0
+        self.max_global_requests_per_minute = max_requests_per_minute
+        self.global_request_count = max_requests_per_minute
+        self.rate_limit_reset_time = datetime.datetime.now() + datetime.timedelta(days=1)
+
+    def check_global_rate_limit(self):
+        result, self.global_request_count, self.rate_limit_reset_time = check_global_rate_limit(
+            self.max_global_requests_per_minute,
+            self.global_request_count,
+            self.rate_limit_reset_time
+        )
+        return result
+
+    def is_over_token_budget(self):
+        return False
+
+def setup_logging():
+    devnull = open(os.devnull, 'w')
+    logging.basicConfig(format='[%(asctime)s] %(name)s - %(levelname)s - %(message)s', level=logging.INFO, stream=devnull)
+    logger = logging.getLogger('DiscordBotLogger')
+    logger.setLevel(logging.INFO)
+    handler = logging.StreamHandler(devnull)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    logger.addHandler(handler)
+    logger.propagate = False
+
+async def run_case(name, bot, message, events):
+    started = time.perf_counter()
+    for _ in range(events):
+        await handle_message(bot, message, message.channel.id)
+    elapsed = time.perf_counter() - started
+    print(f"{name:>16}: {events / elapsed:12,.0f} events/s ({elapsed / events * 1e6:6.2f} us/event)")
+
+async def main(events):
+    user = SimpleNamespace(bot=False, id=123456789012345678, name='someone', display_name='Someone')
+    other_bot = SimpleNamespace(bot=True, id=876543210987654321, name='otherbot', display_name='OtherBot')
+    allowed = BenchChannel(DESIRED_CHANNEL_NAME, 1)
+    elsewhere = BenchChannel('general', 2)
+    content = "just chatting in a busy channel, nothing for the bot here " * 3
+
+    await run_case('other channel', BenchBot(), BenchMessage(content, user, elsewhere), events)
+    await run_case('other bot', BenchBot(), BenchMessage(content, other_bot, allowed), events)
+    await run_case('bot disabled', BenchBot(is_bot_disabled=True), BenchMessage(content, user, allowed), events)
+    await run_case('rate limited', BenchBot(max_requests_per_minute=1), BenchMessage(content, user, allowed), events)
+
+if __name__ == '__main__':
+    setup_logging()
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000))
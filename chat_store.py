@@ -0,0 +1,144 @@
+# chat_store.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# compact, memory-bounded chat history store
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Each channel keeps its latest turns in a ring buffer of slotted ChatMessage
+# records. Messages only hold the raw text, an interned role, the author's ID
+# and a float timestamp; display names are kept once per channel, and the full
+# `[timestamp] name <@id> says: ...` line is only rendered when a prompt is built.
+# Channels are kept in least-recently-active order, and once the estimated size
+# of all histories goes over the memory budget, the least recently active
+# channels are dropped first.
+import sys
+import time
+import datetime
+from collections import OrderedDict, deque
+
+ROLE_USER = sys.intern('user')
+ROLE_ASSISTANT = sys.intern('assistant')
+
+# a single chat turn
+class ChatMessage:
+    __slots__ = ('role', 'content', 'author_id', 'timestamp')
+
+    def __init__(self, role, content, author_id=None, timestamp=None):
+        self.role = sys.intern(role)
+        self.content = content
+        self.author_id = author_id
+        self.timestamp = timestamp if timestamp is not None else time.time()
+
+# history of a single channel
+class ChannelHistory:
+    __slots__ = ('messages', 'authors', 'author_refs', 'size')
+
+    def __init__(self, max_turns):
+        self.messages = deque(maxlen=max_turns)
+        self.authors = {}      # author_id => display name
+        self.author_refs = {}  # author_id => number of their messages in `messages`
+        self.size = CHANNEL_OVERHEAD
+
+# rough per-object sizes used for the memory budget (CPython, 64-bit)
+MESSAGE_OVERHEAD = (sys.getsizeof(ChatMessage(ROLE_USER, '', 0, 0.0))
+                    + sys.getsizeof(0.0)
+                    + sys.getsizeof(2 ** 62)
+                    + 8)  # deque slot
+AUTHOR_OVERHEAD = sys.getsizeof(2 ** 62) + 2 * 64  # key + entries in `authors` and `author_refs`
+CHANNEL_OVERHEAD = (sys.getsizeof(deque(maxlen=1))
+                    + 2 * sys.getsizeof({})
+                    + 128)  # slotted object + OrderedDict entry + key
+
+def message_size(message):
+    return MESSAGE_OVERHEAD + sys.getsizeof(message.content)
+
+# the store itself
+class ChatStore:
+
+    # `max_bytes` = estimated memory budget for all channels (0 = unlimited)
+    def __init__(self, max_turns=30, max_bytes=0):
+        self.max_turns = max_turns
+        self.max_bytes = max_bytes
+        self.channels = OrderedDict()  # least recently active first
+        self.total_bytes = 0
+
+    def get(self, channel_id):
+        return self.channels.get(channel_id)
+
+    # add a turn to the channel's history
+    def append(self, channel_id, role, content, author_id=None, display_name=None, timestamp=None):
+        if not content:
+            return
+
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            channel = self.channels[channel_id] = ChannelHistory(self.max_turns)
+            self.total_bytes += channel.size
+        else:
+            self.channels.move_to_end(channel_id)
+
+        # the ring buffer drops the oldest turn on its own; just account for it
+        if len(channel.messages) == channel.messages.maxlen:
+            oldest = channel.messages[0]
+            self._resize(channel, -message_size(oldest))
+            if oldest.author_id is not None:
+                self._release_author(channel, oldest.author_id)
+
+        message = ChatMessage(role, content, author_id, timestamp)
+        channel.messages.append(message)
+        self._resize(channel, message_size(message))
+
+        if author_id is not None:
+            if author_id in channel.author_refs:
+                channel.author_refs[author_id] += 1
+            else:
+                channel.author_refs[author_id] = 1
+                self._resize(channel, AUTHOR_OVERHEAD)
+
+            previous = channel.authors.get(author_id)
+            if display_name is not None and previous != display_name:
+                if previous is not None:
+                    self._resize(channel, -sys.getsizeof(previous))
+                channel.authors[author_id] = display_name
+                self._resize(channel, sys.getsizeof(display_name))
+
+        self._enforce_budget()
+
+    # render the channel's history as OpenAI chat messages;
+    # `format_timestamp` takes a datetime and returns the string to show
+    def render(self, channel_id, format_timestamp):
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            return []
+
+        rendered = []
+        for message in channel.messages:
+            if message.role == ROLE_USER and message.author_id is not None:
+                timestamp = format_timestamp(datetime.datetime.fromtimestamp(message.timestamp, datetime.timezone.utc))
+                display_name = channel.authors.get(message.author_id, '')
+                content = f"[{timestamp}] {display_name} <@{message.author_id}> says: {message.content}"
+            else:
+                content = message.content
+            rendered.append({"role": message.role, "content": content})
+        return rendered
+
+    # forget an author once their last message has left the ring buffer
+    def _release_author(self, channel, author_id):
+        refs = channel.author_refs[author_id] - 1
+        if refs:
+            channel.author_refs[author_id] = refs
+            return
+        del channel.author_refs[author_id]
+        display_name = channel.authors.pop(author_id, None)
+        self._resize(channel, -AUTHOR_OVERHEAD - (sys.getsizeof(display_name) if display_name is not None else 0))
+
+    def _resize(self, channel, delta):
+        channel.size += delta
+        self.total_bytes += delta
+
+    # drop the least recently active channels until we're within budget
+    # (the most recently active channel is always kept)
+    def _enforce_budget(self):
+        if not self.max_bytes:
+            return
+        while self.total_bytes > self.max_bytes and len(self.channels) > 1:
+            _, channel = self.channels.popitem(last=False)
+            self.total_bytes -= channel.size
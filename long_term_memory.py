@@ -0,0 +1,414 @@
+# long_term_memory.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# retrieval memory over past chat turns
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Chat turns are embedded in batches in the background and stored per channel:
+# unit-length float32 vectors and their timestamps in memory-mapped files, and
+# the texts as JSON lines (see ChannelIndex).
+# On each request, the user's message is embedded and compared against the
+# channel's vectors with a single matrix-vector product (cosine similarity),
+# and the best matching turns that have already left the chat history window
+# are injected into the prompt under a token budget.
+# The embedding backend is pluggable: `OpenAIEmbeddingBackend` for production,
+# `HashingEmbeddingBackend` as a local, dependency-free stand-in.
+import os
+import re
+import json
+import time
+import zlib
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+
+import httpx
+import numpy as np
+
+# ~~~~~~~~~~~~~~~~~~
+# Embedding backends
+# ~~~~~~~~~~~~~~~~~~
+# Backends have a `dim` (None until known) and an async `embed(texts)` that
+# returns a float32 array of shape (len(texts), dim).
+
+# OpenAI embeddings API, using the API key pool
+class OpenAIEmbeddingBackend:
+
+    def __init__(self, api_key_pool, model='text-embedding-3-small', timeout=10.0, on_usage=None):
+        self.api_key_pool = api_key_pool
+        self.model = model
+        self.timeout = timeout
+        self.on_usage = on_usage  # called with (api_key, tokens)
+        self.dim = None
+
+    async def embed(self, texts):
+        api_key = self.api_key_pool.acquire(self.model)
+        if api_key is None:
+            raise RuntimeError(f"All API keys are in cooldown for {self.model}.")
+
+        async with httpx.AsyncClient() as client:
+            response = await client.post("https://api.openai.com/v1/embeddings",
+                                         json={"model": self.model, "input": list(texts)},
+                                         headers={"Authorization": f"Bearer {api_key}"},
+                                         timeout=self.timeout)
+
+        self.api_key_pool.update_from_response(api_key, response.status_code, response.headers, self.model)
+        if response.status_code != 200:
+            raise RuntimeError(f"Embeddings request failed with HTTP {response.status_code}")
+
+        response_json = response.json()
+        if self.on_usage is not None:
+            self.on_usage(api_key, response_json.get('usage', {}).get('total_tokens', 0))
+
+        data = sorted(response_json['data'], key=lambda item: item['index'])
+        vectors = np.array([item['embedding'] for item in data], dtype=np.float32)
+        self.dim = vectors.shape[1]
+        return vectors
+
+# local stand-in: hashed bag of words (no network, deterministic)
+class HashingEmbeddingBackend:
+
+    WORD_PATTERN = re.compile(r'\w+')
+
+    def __init__(self, dim=256):
+        self.dim = dim
+
+    async def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in self.WORD_PATTERN.findall(text.lower()):
+                bucket = zlib.crc32(word.encode('utf-8'))
+                vectors[row, bucket % self.dim] += 1.0 if bucket & 0x80000000 else -1.0
+        return vectors
+
+# scale rows to unit length so that a dot product equals cosine similarity
+def normalize_rows(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+# ~~~~~~~~~~~~~~~~~
+# Per-channel index
+# ~~~~~~~~~~~~~~~~~
+# Files per channel:
+#   <channel_id>.vectors     float32 (capacity, dim), unit-length rows
+#   <channel_id>.timestamps  float64 (capacity,)
+#   <channel_id>.offsets     int64 (capacity,), byte offset of each row's text
+#   <channel_id>.jsonl       the texts, one JSON string per line
+#   <channel_id>.json        `dim` and the number of rows in use (`count`)
+# Everything but the texts is memory-mapped; texts are only read for search hits.
+# With `max_rows` set, the oldest rows are dropped once the index is full.
+class ChannelIndex:
+
+    MIN_CAPACITY = 256
+    ARRAYS = (('vectors', np.float32), ('timestamps', np.float64), ('offsets', np.int64))
+
+    # `max_rows` = most rows (chat turns) to keep (0 = unlimited)
+    def __init__(self, directory, channel_id, dim, max_rows=0):
+        self.dim = dim
+        self.max_rows = max_rows
+        self.paths = {name: os.path.join(directory, f"{channel_id}.{name}") for name, _ in self.ARRAYS}
+        self.texts_path = os.path.join(directory, f"{channel_id}.jsonl")
+        self.meta_path = os.path.join(directory, f"{channel_id}.json")
+        self.lock = threading.Lock()
+
+        self.vectors = None
+        self.timestamps = None
+        self.offsets = None
+        self.capacity = 0
+        self.count = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _row_shape(self, name):
+        return (self.dim,) if name == 'vectors' else ()
+
+    def _row_bytes(self, name, dtype):
+        return int(np.prod(self._row_shape(name), dtype=np.int64)) * np.dtype(dtype).itemsize
+
+    def _load(self):
+        try:
+            with open(self.meta_path, 'r') as file:
+                meta = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            meta = {}
+
+        # start over if the embedding backend (dimensions) changed or files are missing
+        if meta.get('dim') != self.dim or not all(os.path.exists(path) for path in self.paths.values()):
+            for path in list(self.paths.values()) + [self.texts_path]:
+                if os.path.exists(path):
+                    os.remove(path)
+            self.count = 0
+            self._write_meta()
+            self._resize(self.MIN_CAPACITY)
+            return
+
+        # files cut short (i.e. a crash while resizing) are grown back to at least MIN_CAPACITY rows
+        capacity = min(os.path.getsize(self.paths[name]) // self._row_bytes(name, dtype) for name, dtype in self.ARRAYS)
+        self._resize(max(capacity, self.MIN_CAPACITY))
+        self.count = min(int(meta.get('count', 0)), self.capacity)
+
+    def _write_meta(self):
+        with open(self.meta_path, 'w') as file:
+            json.dump({'dim': self.dim, 'count': self.count}, file)
+
+    # (re)map the arrays with room for `capacity` rows
+    def _resize(self, capacity):
+        self.close()
+        self.capacity = capacity
+        for name, dtype in self.ARRAYS:
+            with open(self.paths[name], 'ab') as file:
+                file.truncate(capacity * self._row_bytes(name, dtype))
+            setattr(self, name, np.memmap(self.paths[name], dtype=dtype, mode='r+',
+                                          shape=(capacity,) + self._row_shape(name)))
+
+    # unmap the arrays (they're mapped again on the next add/search)
+    def close(self):
+        for name, _ in self.ARRAYS:
+            array = getattr(self, name)
+            if array is not None:
+                array.flush()
+                setattr(self, name, None)
+
+    def _ensure_open(self):
+        if self.vectors is None:
+            self._resize(self.capacity)
+
+    # add unit-length vectors with their texts and timestamps
+    def add(self, vectors, texts, timestamps):
+        with self.lock:
+            self._ensure_open()
+            if self.max_rows:
+                # a batch bigger than the whole index only keeps its newest rows
+                vectors, texts, timestamps = vectors[-self.max_rows:], texts[-self.max_rows:], timestamps[-self.max_rows:]
+                if self.count + len(texts) > self.max_rows:
+                    # drop down to 3/4 full, so the rewrite doesn't happen on every batch
+                    self._drop_oldest(self.count + len(texts) - self.max_rows * 3 // 4)
+
+            start = self.count
+            needed = start + len(texts)
+            if needed > self.capacity:
+                capacity = max(self.capacity, self.MIN_CAPACITY)
+                while capacity < needed:
+                    capacity *= 2
+                if self.max_rows:
+                    capacity = max(needed, min(capacity, self.max_rows))
+                self._resize(capacity)
+
+            with open(self.texts_path, 'ab') as file:
+                for row, text in enumerate(texts, start=start):
+                    self.offsets[row] = file.tell()
+                    file.write(json.dumps(text).encode('utf-8') + b'\n')
+            self.vectors[start:needed] = vectors
+            self.timestamps[start:needed] = timestamps
+            for name, _ in self.ARRAYS:
+                getattr(self, name).flush()
+
+            # rows only count once everything is on disk
+            self.count = needed
+            self._write_meta()
+
+    # drop the oldest `rows` rows (at most all of them), moving the rest to the front;
+    # the index counts as empty while this runs, so a crash loses rows instead of
+    # leaving offsets that point into the wrong texts
+    def _drop_oldest(self, rows):
+        rows = min(rows, self.count)
+        keep = self.count - rows
+        self.count = 0
+        self._write_meta()
+
+        start = int(self.offsets[rows]) if keep else 0
+        temporary_path = self.texts_path + '.tmp'
+        with open(self.texts_path, 'rb') as source, open(temporary_path, 'wb') as target:
+            if keep:
+                source.seek(start)
+                while True:
+                    chunk = source.read(1 << 20)
+                    if not chunk:
+                        break
+                    target.write(chunk)
+        os.replace(temporary_path, self.texts_path)
+
+        self.vectors[:keep] = self.vectors[rows:rows + keep]
+        self.timestamps[:keep] = self.timestamps[rows:rows + keep]
+        self.offsets[:keep] = self.offsets[rows:rows + keep] - start
+        for name, _ in self.ARRAYS:
+            getattr(self, name).flush()
+
+        self.count = keep
+        self._write_meta()
+
+    def _read_texts(self, rows):
+        texts = []
+        with open(self.texts_path, 'rb') as file:
+            for row in rows:
+                file.seek(int(self.offsets[row]))
+                texts.append(json.loads(file.readline()))
+        return texts
+
+    # top-k (score, timestamp, text) by cosine similarity, only turns older than `before`
+    def search(self, query, k, before=None):
+        with self.lock:
+            count = self.count
+            if count == 0:
+                return []
+            self._ensure_open()
+
+            scores = self.vectors[:count] @ query
+            if before is not None:
+                scores[self.timestamps[:count] >= before] = -np.inf
+
+            k = min(k, count)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = [row for row in top[np.argsort(-scores[top])] if np.isfinite(scores[row])]
+            texts = self._read_texts(top)
+            return [(float(scores[row]), float(self.timestamps[row]), text) for row, text in zip(top, texts)]
+
+# ~~~~~~~~~~~~~~~~~~
+# The memory itself
+# ~~~~~~~~~~~~~~~~~~
+class LongTermMemory:
+
+    def __init__(self, directory, backend, count_tokens, top_k=5, min_score=0.3, max_tokens=500,
+                 batch_size=32, flush_interval=5.0, max_rows_per_channel=0, max_queue_size=10000,
+                 max_open_indexes=64, retry_delay=5.0, max_retry_delay=60.0, max_attempts=6, logger=None):
+        self.directory = directory
+        self.backend = backend
+        self.count_tokens = count_tokens
+        self.top_k = top_k
+        self.min_score = min_score
+        self.max_tokens = max_tokens
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_rows_per_channel = max_rows_per_channel
+        self.max_open_indexes = max_open_indexes
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.max_attempts = max_attempts
+        self.logger = logger or logging.getLogger(__name__)
+
+        self.indexes = {}  # channel_id => ChannelIndex
+        self.open_indexes = OrderedDict()  # channel_id => ChannelIndex, least recently used first
+        # `_get_index` runs in worker threads; only one of them may create a channel's index
+        self.indexes_lock = threading.Lock()
+        self.queue = asyncio.Queue(maxsize=max_queue_size)
+        self.worker = None
+
+    # start the background embedding worker (from within the event loop)
+    def start(self):
+        if self.worker is None:
+            self.worker = asyncio.create_task(self._embed_worker())
+
+    # queue a chat turn for embedding; never blocks
+    def remember(self, channel_id, text, timestamp=None):
+        try:
+            self.queue.put_nowait((channel_id, text, timestamp if timestamp is not None else time.time()))
+        except asyncio.QueueFull:
+            self.logger.warning("Long-term memory queue is full, dropping a chat turn.")
+
+    def _get_index(self, channel_id, dim):
+        with self.indexes_lock:
+            index = self.indexes.get(channel_id)
+            if index is None or index.dim != dim:
+                if index is not None:
+                    index.close()
+                index = self.indexes[channel_id] = ChannelIndex(self.directory, channel_id, dim, self.max_rows_per_channel)
+
+            # keep only the most recently used indexes mapped
+            self.open_indexes[channel_id] = index
+            self.open_indexes.move_to_end(channel_id)
+            while len(self.open_indexes) > self.max_open_indexes:
+                _, stale = self.open_indexes.popitem(last=False)
+                with stale.lock:
+                    stale.close()
+            return index
+
+    # collect up to `batch_size` turns (waiting at most `flush_interval`), embed, store
+    async def _embed_worker(self):
+        while True:
+            batch = [await self.queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self._store_batch(batch)
+            finally:
+                # lets `queue.join()` wait until everything queued so far is stored
+                for _ in batch:
+                    self.queue.task_done()
+
+    # embed and store a batch; failed attempts (i.e. rate limits, network errors)
+    # are retried with a doubling delay, and the turns are only dropped after
+    # `max_attempts`. Channels that were already stored aren't stored twice.
+    async def _store_batch(self, batch):
+        stored = set()  # channels whose turns are already in their index
+        delay = self.retry_delay
+        for attempt in range(1, self.max_attempts + 1):
+            pending = [item for item in batch if item[0] not in stored]
+            try:
+                vectors = normalize_rows(await self.backend.embed([text for _, text, _ in pending]))
+                by_channel = {}
+                for row, (channel_id, text, timestamp) in enumerate(pending):
+                    by_channel.setdefault(channel_id, []).append((row, text, timestamp))
+
+                for channel_id, items in by_channel.items():
+                    index = await asyncio.to_thread(self._get_index, channel_id, vectors.shape[1])
+                    rows = [row for row, _, _ in items]
+                    await asyncio.to_thread(index.add, vectors[rows],
+                                            [text for _, text, _ in items],
+                                            [timestamp for _, _, timestamp in items])
+                    stored.add(channel_id)
+                return
+            except Exception as e:
+                if attempt == self.max_attempts:
+                    self.logger.error(f"Long-term memory: failed to embed {len(pending)} chat turn(s), dropping them: {e}")
+                    return
+                self.logger.warning(f"Long-term memory: failed to embed {len(pending)} chat turn(s) "
+                                    f"(attempt {attempt}/{self.max_attempts}), retrying in {delay:g}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+
+    # best matching past turns for `query` that fit into the token budget,
+    # only from turns older than `before` (i.e. no longer in the chat history)
+    async def recall(self, channel_id, query, before=None):
+        if not os.path.exists(os.path.join(self.directory, f"{channel_id}.vectors")) and channel_id not in self.indexes:
+            return []
+
+        try:
+            query_vector = normalize_rows(await self.backend.embed([query]))[0]
+            index = await asyncio.to_thread(self._get_index, channel_id, query_vector.shape[0])
+            results = await asyncio.to_thread(index.search, query_vector, self.top_k, before)
+        except Exception as e:
+            self.logger.error(f"Long-term memory: recall failed: {e}")
+            return []
+
+        snippets = []
+        used_tokens = 0
+        for score, timestamp, text in results:
+            if score < self.min_score:
+                break
+            tokens = self.count_tokens(text)
+            if used_tokens + tokens > self.max_tokens:
+                continue
+            snippets.append((timestamp, text))
+            used_tokens += tokens
+
+        # oldest first, like the rest of the conversation
+        return [text for _, text in sorted(snippets)]
+
+    # recall and wrap the snippets into a system message (None if nothing relevant)
+    async def recall_message(self, channel_id, query, before=None):
+        snippets = await self.recall(channel_id, query, before)
+        if not snippets:
+            return None
+        return {
+            "role": "system",
+            "content": "Relevant excerpts from earlier in this channel's conversation:\n" + "\n".join(snippets)
+        }
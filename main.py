@@ -10,6 +10,7 @@ import configparser
 import os
 import sys
 import logging
+import threading
 from logging.handlers import RotatingFileHandler
 from functools import partial
 
@@ -29,14 +30,19 @@ from discord.ext import commands
 
 # discord-bot modules
 import utils
-from text_message_handler import handle_message
+from text_message_handler import handle_message, MAX_TURNS
+from chat_store import ChatStore
+from long_term_memory import LongTermMemory, OpenAIEmbeddingBackend, HashingEmbeddingBackend
 from modules import count_tokens, read_total_token_usage, write_total_token_usage
+from modules import read_api_key_usage
 from modules import markdown_to_html, check_global_rate_limit
 from modules import log_message, rotate_log_file
+from profiling import SamplingProfiler, SlowCallbackDetector, report_prefix
 
 # read the API tokens
 from bot_token import get_discord_bot_token
-from api_key import get_api_key
+from api_key import get_api_keys
+from api_key_pool import APIKeyPool
 
 # Call the startup message function
 utils.print_startup_message(version_number)
@@ -63,7 +69,8 @@ class DiscordBot:
         # Attempt to get bot & API tokens
         try:
             self.bot_token = get_discord_bot_token()
-            openai.api_key = get_api_key()
+            api_keys = get_api_keys()
+            openai.api_key = api_keys[0]
         except FileNotFoundError as e:
             self.logger.error(f"Required configuration not found: {e}")
             sys.exit(1)
@@ -72,19 +79,37 @@ class DiscordBot:
         self.load_config()
         self.initialize_logging()
 
+        # Pool of OpenAI API keys; requests are routed to the key with the most headroom
+        self.api_key_pool = APIKeyPool(api_keys,
+                                       rate_limit_cooldown=self.api_key_rate_limit_cooldown,
+                                       auth_failure_cooldown=self.api_key_auth_failure_cooldown)
+        self.logger.info(f"Loaded {len(self.api_key_pool)} OpenAI API key(s).")
+
         # Initialize chat logging if enabled
         self.initialize_chat_logging()
 
         self.token_usage_file = 'token_usage.json'
         self.total_token_usage = self.read_total_token_usage()
-        self.max_tokens_config = self.config.getint('GlobalMaxTokenUsagePerDay', 100000)
+        self.token_usage_date = datetime.datetime.utcnow().strftime('%Y-%m-%d')
+        self.token_usage_write_delay = 5.0
+        self.token_usage_write_task = None
+        self.token_usage_write_lock = asyncio.Lock()
+        self.restore_api_key_usage()
+        self.max_tokens_config = self.config.getint('GlobalMaxTokenUsagePerDay', 0)  # 0 = disabled
 
         self.global_request_count = 0
         self.rate_limit_reset_time = datetime.datetime.now()
         self.max_global_requests_per_minute = self.config.getint('MaxGlobalRequestsPerMinute', 60)
 
-        # Initialize the chat history dictionary
-        self.chat_history = {}        
+        # Initialize the chat history store (ring buffer per channel, global memory budget)
+        self.chat_store = ChatStore(max_turns=MAX_TURNS, max_bytes=self.chat_history_max_bytes)
+
+        # Optional long-term (retrieval) memory over past chat turns
+        self.long_term_memory = self.initialize_long_term_memory()
+
+        # On-demand profiling (see `!profile`) and the slow callback detector
+        self.active_profiler = None
+        self.slow_callback_detector = None
 
         # Create Discord client
         # self.client = discord.Client(intents=discord.Intents.default())
@@ -106,6 +131,8 @@ class DiscordBot:
         self.mention_user_odds = self.config.getfloat('MentionUserOdds', 0.3)  # Default to 0.3
 
         self.timeout = self.config.getfloat('Timeout', 30.0)        
+        self.api_key_rate_limit_cooldown = self.config.getfloat('APIKeyRateLimitCooldown', 60.0)
+        self.api_key_auth_failure_cooldown = self.config.getfloat('APIKeyAuthFailureCooldown', 3600.0)
         self.max_tokens = self.config.getint('MaxTokens', 4096)
         self.max_retries = self.config.getint('MaxRetries', 3)
         self.retry_delay = self.config.getint('RetryDelay', 25)
@@ -134,9 +161,26 @@ class DiscordBot:
         # Session management settings
         self.session_timeout_minutes = self.config.getint('SessionTimeoutMinutes', 60)  # Default to 1 minute if not set
         self.max_retained_messages = self.config.getint('MaxRetainedMessages', 2)     # Default to 0 (clear all) if not set
+        self.chat_history_max_bytes = self.config.getint('ChatHistoryMaxMB', 64) * 1024 * 1024  # Convert MB to bytes
+        # Long-term memory
+        self.long_term_memory_enabled = self.config.getboolean('LongTermMemoryEnabled', False)
+        self.long_term_memory_directory = self.config.get('LongTermMemoryDirectory', 'memory')
+        self.long_term_memory_backend = self.config.get('LongTermMemoryBackend', 'openai')
+        self.long_term_memory_model = self.config.get('LongTermMemoryEmbeddingModel', 'text-embedding-3-small')
+        self.long_term_memory_top_k = self.config.getint('LongTermMemoryTopK', 5)
+        self.long_term_memory_min_score = self.config.getfloat('LongTermMemoryMinScore', 0.3)
+        self.long_term_memory_max_tokens = self.config.getint('LongTermMemoryMaxTokens', 500)
+        self.long_term_memory_batch_size = self.config.getint('LongTermMemoryBatchSize', 32)
+        self.long_term_memory_flush_seconds = self.config.getfloat('LongTermMemoryFlushSeconds', 5.0)
+        self.long_term_memory_max_turns = self.config.getint('LongTermMemoryMaxTurnsPerChannel', 10000)
         # User commands
         self.reset_command_enabled = self.config.getboolean('ResetCommandEnabled', False)
         self.admin_only_reset = self.config.getboolean('AdminOnlyReset', True)
+        # Profiling
+        self.profiling_command_enabled = self.config.getboolean('ProfilingCommandEnabled', False)
+        self.profiling_max_seconds = self.config.getint('ProfilingMaxSeconds', 300)
+        self.profiling_sample_interval = self.config.getfloat('ProfilingSampleIntervalMs', 5) / 1000
+        self.slow_callback_threshold = self.config.getfloat('SlowCallbackThresholdMs', 0) / 1000
 
     def initialize_logging(self):
         self.logger = logging.getLogger('DiscordBotLogger')
@@ -168,9 +212,59 @@ class DiscordBot:
     def read_total_token_usage(self):
         return read_total_token_usage(self.token_usage_file)
 
-    # write latest token count data
-    def write_total_token_usage(self, usage):
-        write_total_token_usage(self.token_usage_file, usage)
+    # current token count data: (total, per-api-key breakdown, date)
+    def token_usage_snapshot(self):
+        return self.total_token_usage, self.api_key_pool.usage_report(), self.token_usage_date
+
+    # queue a write of the token usage file; writes are debounced by
+    # `token_usage_write_delay` seconds and done in a worker thread
+    def schedule_token_usage_write(self):
+        if self.token_usage_write_task is None:
+            self.token_usage_write_task = asyncio.get_running_loop().create_task(
+                self.flush_token_usage(self.token_usage_write_delay))
+
+    # write latest token count data (with the per-api-key breakdown)
+    async def flush_token_usage(self, delay, snapshot=None):
+        await asyncio.sleep(delay)
+        self.token_usage_write_task = None
+        if snapshot is None:
+            snapshot = self.token_usage_snapshot()
+        async with self.token_usage_write_lock:
+            await asyncio.to_thread(write_total_token_usage, self.token_usage_file, *snapshot)
+
+    # restore today's per-api-key usage counters after a restart
+    def restore_api_key_usage(self):
+        key_usage = read_api_key_usage(self.token_usage_file)
+        for state in self.api_key_pool.keys:
+            usage = key_usage.get(state.label, {})
+            state.requests = usage.get('requests', 0)
+            state.tokens = usage.get('tokens', 0)
+            state.errors = usage.get('errors', 0)
+
+    # start a new day in the token ledger if the (UTC) date has changed
+    def roll_token_usage_date(self):
+        current_date = datetime.datetime.utcnow().strftime('%Y-%m-%d')
+        if current_date != self.token_usage_date:
+            # write out the previous day's final numbers right away
+            if self.token_usage_write_task is not None:
+                self.token_usage_write_task.cancel()
+                self.token_usage_write_task = asyncio.get_running_loop().create_task(
+                    self.flush_token_usage(0, self.token_usage_snapshot()))
+            self.token_usage_date = current_date
+            self.total_token_usage = 0
+            self.api_key_pool.reset_usage()
+
+    # check the daily token budget (GlobalMaxTokenUsagePerDay)
+    def is_over_token_budget(self):
+        self.roll_token_usage_date()
+        return self.total_token_usage >= self.max_tokens_config
+
+    # add the tokens used by a request to the daily ledger and to the key's usage
+    def record_token_usage(self, api_key, tokens):
+        self.roll_token_usage_date()
+        self.total_token_usage += tokens
+        self.api_key_pool.record_usage(api_key, tokens)
+        self.schedule_token_usage_write()
 
     # logging functionality
     def log_message(self, message_type, user_id, message):
@@ -212,6 +306,22 @@ class DiscordBot:
             pass
         return chat_history
 
+    # check if the user is the bot owner or one of the bot admins
+    def is_bot_admin(self, user_id):
+        if user_id in self.bot_admin_ids:
+            return True
+        return self.bot_owner_id != '0' and str(user_id) == self.bot_owner_id
+
+    # profile the event loop for `seconds` and write the reports into the data directory
+    # (the caller sets `self.active_profiler` before its first await and clears it afterwards)
+    async def run_profiler(self, profiler, seconds):
+        profiler.start()
+        await asyncio.sleep(seconds)
+        await asyncio.to_thread(profiler.stop)
+        paths = await asyncio.to_thread(profiler.write_reports, self.data_directory, report_prefix())
+        await asyncio.to_thread(utils.cleanup_data_directory, self.data_directory, self.max_storage_mb)
+        return profiler.summary(), paths
+
     # split long messages
     def split_large_messages(self, message, max_length=4096):
         return [message[i:i+max_length] for i in range(0, len(message), max_length)]
@@ -222,6 +332,26 @@ class DiscordBot:
         tz_aware_dt = dt.astimezone(self.timezone)
         return tz_aware_dt.strftime('%Y-%m-%d %H:%M:%S %Z')
 
+    def initialize_long_term_memory(self):
+        if not self.long_term_memory_enabled:
+            return None
+
+        if self.long_term_memory_backend == 'local':
+            backend = HashingEmbeddingBackend()
+        else:
+            backend = OpenAIEmbeddingBackend(self.api_key_pool, model=self.long_term_memory_model,
+                                             timeout=self.timeout, on_usage=self.record_token_usage)
+
+        self.logger.info(f"Long-term memory enabled ({self.long_term_memory_backend} embeddings, stored in `{self.long_term_memory_directory}`)")
+        return LongTermMemory(self.long_term_memory_directory, backend, self.count_tokens,
+                              top_k=self.long_term_memory_top_k,
+                              min_score=self.long_term_memory_min_score,
+                              max_tokens=self.long_term_memory_max_tokens,
+                              batch_size=self.long_term_memory_batch_size,
+                              flush_interval=self.long_term_memory_flush_seconds,
+                              max_rows_per_channel=self.long_term_memory_max_turns,
+                              logger=self.logger)
+
     def initialize_chat_logging(self):
         if self.chat_logging_enabled:
             self.chat_logger = logging.getLogger('ChatLogger')
@@ -235,6 +365,17 @@ class DiscordBot:
         async def on_ready():
             # Logic when bot is ready
             logging.info(f'Logged in as {self.client.user}')
+
+            # Start the long-term memory's background embedding worker
+            if self.long_term_memory is not None:
+                self.long_term_memory.start()
+
+            # Start the slow callback detector if enabled (on_ready can fire again on reconnects)
+            if self.slow_callback_threshold > 0 and self.slow_callback_detector is None:
+                self.slow_callback_detector = SlowCallbackDetector(asyncio.get_running_loop(), self.slow_callback_threshold, self.logger)
+                self.slow_callback_detector.start()
+                self.logger.info(f"Slow callback detector started (threshold: {self.slow_callback_threshold * 1000:.0f} ms)")
+
             # Iterate through all the guilds (servers) the bot is in
             for guild in self.client.guilds:
                 # Iterate through all the channels in the guild
@@ -247,16 +388,38 @@ class DiscordBot:
 
         @self.client.event
         async def on_message(message):
-            # Avoid responding to self
-            if message.author == self.client.user:
-                return
-            
-            # Extract channel_id from the message
-            channel_id = message.channel.id
-
-            # Handle messages
-            # Handle the message using your text message handler
-            await handle_message(self, message, channel_id)
+            # Bot commands (only registered if enabled in `config.ini`)
+            if self.profiling_command_enabled and not message.author.bot and message.content.startswith(self.client.command_prefix):
+                ctx = await self.client.get_context(message)
+                if ctx.valid:
+                    await self.client.invoke(ctx)
+                    return
+
+            # Handle the message using the text message handler;
+            # it drops bots (incl. ourselves), other channels etc. before doing any work
+            await handle_message(self, message, message.channel.id)
+
+        # Admin-only profiling: `!profile <seconds>`
+        if self.profiling_command_enabled:
+            @self.client.command(name='profile')
+            async def profile(ctx, seconds: int = 10):
+                if not self.is_bot_admin(ctx.author.id):
+                    self.logger.info(f"Ignored !profile from non-admin user {ctx.author.id}")
+                    return
+                if self.active_profiler is not None:
+                    await ctx.send("A profiling run is already in progress.")
+                    return
+
+                # claim the profiler before the first await so that concurrent calls are turned away
+                profiler = self.active_profiler = SamplingProfiler(threading.get_ident(), interval=self.profiling_sample_interval)
+                seconds = max(1, min(seconds, self.profiling_max_seconds))
+                try:
+                    await ctx.send(f"Profiling for {seconds} seconds...")
+                    summary, paths = await self.run_profiler(profiler, seconds)
+                finally:
+                    self.active_profiler = None
+                self.logger.info(f"Profiling reports written: {', '.join(paths)}")
+                await ctx.send(f"```\n{summary[:1800]}\n```\nReports: {', '.join(os.path.basename(path) for path in paths)}")
 
         """ @self.client.event
         async def on_message(message):
@@ -25,16 +25,29 @@ def read_total_token_usage(token_usage_file):
         # If the file doesn't exist or is invalid, return 0
         return 0
 
+# read today's per-api-key usage (stored alongside the daily totals)
+def read_api_key_usage(token_usage_file):
+    try:
+        with open(token_usage_file, 'r') as file:
+            data = json.load(file)
+        current_date = datetime.datetime.utcnow().strftime('%Y-%m-%d')
+        return data.get('per_key', {}).get(current_date, {})
+    except (FileNotFoundError, json.JSONDecodeError, AttributeError):
+        return {}
+
 # write latest token count data
-def write_total_token_usage(token_usage_file, usage):
+# (optionally with the per-api-key breakdown under `per_key`, and for a given date)
+def write_total_token_usage(token_usage_file, usage, key_usage=None, date=None):
     try:
         with open(token_usage_file, 'r') as file:
             data = json.load(file)
     except (FileNotFoundError, json.JSONDecodeError):
         data = {}  # Initialize a new dictionary if the file doesn't exist or is invalid
 
-    current_date = datetime.datetime.utcnow().strftime('%Y-%m-%d')
+    current_date = date or datetime.datetime.utcnow().strftime('%Y-%m-%d')
     data[current_date] = usage  # Update the current date's usage
+    if key_usage is not None:
+        data.setdefault('per_key', {})[current_date] = key_usage
 
     with open(token_usage_file, 'w') as file:
         json.dump(data, file)
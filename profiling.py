@@ -0,0 +1,195 @@
+# profiling.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# on-demand profiling hooks for the running bot
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# - SamplingProfiler: samples the event loop thread's stack from a background
+#   thread and takes `tracemalloc` snapshots at the start and end of the run.
+# - SlowCallbackDetector: a heartbeat on the event loop plus a watchdog thread;
+#   if the heartbeat stalls longer than the threshold, whatever is blocking the
+#   loop gets logged along with its stack, and the full length of the stall is
+#   logged once the heartbeat comes back.
+# Neither one costs anything until it's started.
+import os
+import sys
+import time
+import logging
+import datetime
+import threading
+import traceback
+import tracemalloc
+from collections import Counter
+
+# describe a frame as `function (file.py:line)`
+def describe_frame(frame, lineno=None):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{lineno or code.co_firstlineno})"
+
+# sampling profiler + tracemalloc snapshots for a fixed window
+class SamplingProfiler:
+
+    def __init__(self, thread_id, interval=0.005, tracemalloc_frames=10):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.tracemalloc_frames = tracemalloc_frames
+
+        self.stacks = Counter()  # collapsed stack => samples
+        self.lines = Counter()   # innermost line => samples
+        self.samples = 0
+
+        self.started_at = None
+        self.stopped_at = None
+        self.started_tracemalloc = False
+        self.start_snapshot = None
+        self.end_snapshot = None
+
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        # don't touch tracemalloc if someone else is already tracing
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.tracemalloc_frames)
+            self.started_tracemalloc = True
+        self.start_snapshot = tracemalloc.take_snapshot()
+
+        self.started_at = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name='SamplingProfiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.stopped_at = time.monotonic()
+
+        self.end_snapshot = tracemalloc.take_snapshot()
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+
+            self.samples += 1
+            self.lines[describe_frame(frame, frame.f_lineno)] += 1
+
+            stack = []
+            while frame is not None:
+                stack.append(describe_frame(frame))
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    # inclusive samples per function (counted once per stack)
+    def function_totals(self):
+        totals = Counter()
+        for stack, count in self.stacks.items():
+            for function in set(stack.split(';')):
+                totals[function] += count
+        return totals
+
+    # a short plain-text summary (top lines by self samples)
+    def summary(self, limit=10):
+        duration = (self.stopped_at or time.monotonic()) - self.started_at
+        lines = [f"{self.samples} samples over {duration:.1f}s"]
+        for line, count in self.lines.most_common(limit):
+            lines.append(f"{count * 100 / max(1, self.samples):5.1f}%  {line}")
+        return '\n'.join(lines)
+
+    # write the reports into `directory`; returns the written file paths
+    def write_reports(self, directory, prefix):
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+
+        # collapsed stacks (i.e. for `flamegraph.pl` or speedscope)
+        path = os.path.join(directory, f"{prefix}_stacks.txt")
+        with open(path, 'w', encoding='utf-8') as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f"{stack} {count}\n")
+        paths.append(path)
+
+        # top lines (self) and functions (inclusive)
+        path = os.path.join(directory, f"{prefix}_profile.txt")
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(self.summary(limit=50) + '\n\n')
+            file.write("Inclusive samples per function:\n")
+            for function, count in self.function_totals().most_common(50):
+                file.write(f"{count * 100 / max(1, self.samples):5.1f}%  {function}\n")
+        paths.append(path)
+
+        # tracemalloc: what's allocated now, and what grew during the window
+        if self.end_snapshot is not None:
+            path = os.path.join(directory, f"{prefix}_tracemalloc.txt")
+            with open(path, 'w', encoding='utf-8') as file:
+                file.write("Top allocations:\n")
+                for stat in self.end_snapshot.statistics('lineno')[:50]:
+                    file.write(f"{stat}\n")
+                file.write("\nTop growth during the profiling window:\n")
+                for stat in self.end_snapshot.compare_to(self.start_snapshot, 'lineno')[:50]:
+                    file.write(f"{stat}\n")
+            paths.append(path)
+
+        return paths
+
+# logs any callback that blocks the event loop longer than `threshold` seconds
+class SlowCallbackDetector:
+
+    def __init__(self, loop, threshold, logger=None):
+        self.loop = loop
+        self.threshold = threshold
+        # tick and check often, so a stall just over the threshold isn't missed
+        # and its length is off by at most a tenth of the threshold
+        self.interval = max(0.005, threshold / 10)
+        self.logger = logger or logging.getLogger(__name__)
+
+        self.loop_thread_id = None
+        self.tick_due = None       # when the next heartbeat should run
+        self.reported_due = None   # the stalled heartbeat the watchdog already logged
+
+        self._handle = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    # must be called from within the event loop's thread
+    def start(self):
+        self.loop_thread_id = threading.get_ident()
+        self._tick()
+        self._thread = threading.Thread(target=self._watch, name='SlowCallbackDetector', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._handle is not None:
+            self._handle.cancel()
+
+    # heartbeat on the event loop; a late heartbeat means the loop was blocked
+    # for (at least) as long as it was late, so log the full overrun here
+    def _tick(self):
+        now = time.monotonic()
+        if self.tick_due is not None:
+            blocked_for = now - self.tick_due
+            if blocked_for >= self.threshold:
+                self.logger.warning("Event loop was blocked for %.3fs (threshold %.3fs)",
+                                    blocked_for, self.threshold)
+        self.tick_due = now + self.interval
+        self._handle = self.loop.call_later(self.interval, self._tick)
+
+    # watchdog thread: while a stall is still going on, log it once
+    # with the loop thread's stack, i.e. whatever is blocking it
+    def _watch(self):
+        while not self._stop_event.wait(self.interval):
+            tick_due = self.tick_due
+            blocked_for = time.monotonic() - tick_due
+            if blocked_for < self.threshold or tick_due == self.reported_due:
+                continue
+
+            frame = sys._current_frames().get(self.loop_thread_id)
+            stack = ''.join(traceback.format_stack(frame)) if frame is not None else '(no stack available)\n'
+            self.logger.warning("Event loop blocked for %.3fs so far (threshold %.3fs), stack:\n%s",
+                                blocked_for, self.threshold, stack)
+            self.reported_due = tick_due
+
+# timestamped file name prefix for the reports
+def report_prefix():
+    return datetime.datetime.now().strftime('profile_%Y%m%d_%H%M%S')
@@ -0,0 +1,150 @@
+# test_api_key_pool.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# header parsing, headroom routing and cooldowns of the API key pool
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import api_key_pool
+from api_key_pool import APIKeyPool, parse_reset_duration
+
+KEY_A = 'sk-test-aaaaaaaa11111111'
+KEY_B = 'sk-test-bbbbbbbb22222222'
+
+# a clock the tests can move forward
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(api_key_pool.time, 'monotonic', clock)
+    return clock
+
+def rate_limit_headers(remaining_requests, remaining_tokens, limit_requests=100, limit_tokens=10000):
+    return {
+        'x-ratelimit-limit-requests': str(limit_requests),
+        'x-ratelimit-limit-tokens': str(limit_tokens),
+        'x-ratelimit-remaining-requests': str(remaining_requests),
+        'x-ratelimit-remaining-tokens': str(remaining_tokens),
+        'x-ratelimit-reset-requests': '30s',
+        'x-ratelimit-reset-tokens': '6m0s',
+    }
+
+@pytest.mark.parametrize('value, seconds', [
+    ('20ms', 0.02),
+    ('1s', 1.0),
+    ('6m0s', 360.0),
+    ('1h2m3.5s', 3723.5),
+    ('', None),
+    (None, None),
+    ('soon', None),
+])
+def test_parse_reset_duration(value, seconds):
+    assert parse_reset_duration(value) == (pytest.approx(seconds) if seconds is not None else None)
+
+def test_routes_to_key_with_most_headroom(clock):
+    pool = APIKeyPool([KEY_A, KEY_B])
+    pool.update_from_response(KEY_A, 200, rate_limit_headers(remaining_requests=10, remaining_tokens=9000))
+    pool.update_from_response(KEY_B, 200, rate_limit_headers(remaining_requests=80, remaining_tokens=8000))
+    assert pool.acquire() == KEY_B
+
+    # the scarcer of the two windows counts
+    pool.update_from_response(KEY_B, 200, rate_limit_headers(remaining_requests=80, remaining_tokens=500))
+    assert pool.acquire() == KEY_A
+
+def test_headroom_is_restored_after_the_window_resets(clock):
+    pool = APIKeyPool([KEY_A, KEY_B])
+    pool.update_from_response(KEY_A, 200, rate_limit_headers(remaining_requests=1, remaining_tokens=100))
+    pool.update_from_response(KEY_B, 200, rate_limit_headers(remaining_requests=50, remaining_tokens=5000))
+    assert pool.acquire() == KEY_B
+
+    clock.now += 361  # both windows of KEY_A have reset; KEY_B's too, so least used wins
+    assert pool.acquire() == KEY_A
+
+def test_unknown_keys_are_spread_by_usage(clock):
+    pool = APIKeyPool([KEY_A, KEY_B])
+    assert {pool.acquire(), pool.acquire()} == {KEY_A, KEY_B}
+
+def test_rate_limited_key_cools_down(clock):
+    pool = APIKeyPool([KEY_A, KEY_B], rate_limit_cooldown=60)
+    pool.update_from_response(KEY_A, 429, {})
+    assert pool.acquire() == KEY_B
+    assert pool.acquire() == KEY_B
+
+    clock.now += 60
+    assert KEY_A in {pool.acquire(), pool.acquire()}
+
+def test_fractional_retry_after_is_honored(clock):
+    pool = APIKeyPool([KEY_A], rate_limit_cooldown=60)
+    pool.update_from_response(KEY_A, 429, {'retry-after': '0.5'})
+    assert pool.acquire() is None
+    assert pool.seconds_until_available() == pytest.approx(0.5)
+
+    clock.now += 0.5
+    assert pool.acquire() == KEY_A
+
+def test_rate_limit_cooldown_uses_reset_headers(clock):
+    pool = APIKeyPool([KEY_A], rate_limit_cooldown=60)
+    pool.update_from_response(KEY_A, 429, {'x-ratelimit-reset-requests': '2s', 'x-ratelimit-reset-tokens': '5s'})
+    assert pool.seconds_until_available() == pytest.approx(5.0)
+
+def test_rejected_key_cools_down(clock):
+    pool = APIKeyPool([KEY_A, KEY_B], auth_failure_cooldown=3600)
+    pool.update_from_response(KEY_B, 401, {})
+    assert [pool.acquire() for _ in range(3)] == [KEY_A] * 3
+
+    pool.update_from_response(KEY_A, 401, {})
+    assert pool.acquire() is None
+    assert pool.seconds_until_available() == pytest.approx(3600)
+
+def test_rate_limits_are_tracked_per_model(clock):
+    pool = APIKeyPool([KEY_A, KEY_B], rate_limit_cooldown=60)
+    pool.update_from_response(KEY_A, 200, rate_limit_headers(remaining_requests=5, remaining_tokens=500), 'gpt-4')
+    pool.update_from_response(KEY_B, 200, rate_limit_headers(remaining_requests=90, remaining_tokens=9000), 'gpt-4')
+
+    # an embeddings 429 on KEY_B leaves its chat headroom alone
+    pool.update_from_response(KEY_B, 429, {'retry-after': '30'}, 'text-embedding-3-small')
+    assert pool.acquire('gpt-4') == KEY_B
+    assert pool.acquire('text-embedding-3-small') == KEY_A
+    assert pool.seconds_until_available('gpt-4') == 0.0
+
+    # ... and vice versa
+    pool.update_from_response(KEY_A, 429, {'retry-after': '30'}, 'gpt-4')
+    pool.update_from_response(KEY_B, 429, {'retry-after': '20'}, 'gpt-4')
+    assert pool.acquire('gpt-4') is None
+    assert pool.seconds_until_available('gpt-4') == pytest.approx(20)
+    assert pool.acquire('text-embedding-3-small') == KEY_A
+
+def test_rejected_key_cools_down_for_every_model(clock):
+    pool = APIKeyPool([KEY_A, KEY_B])
+    pool.update_from_response(KEY_A, 401, {}, 'text-embedding-3-small')
+    assert pool.acquire('gpt-4') == KEY_B
+    assert pool.acquire('gpt-4') == KEY_B
+
+def test_usage_is_shared_by_all_models(clock):
+    pool = APIKeyPool([KEY_A])
+    pool.acquire('gpt-4')
+    pool.acquire('text-embedding-3-small')
+    pool.record_usage(KEY_A, 100)
+    pool.record_usage(KEY_A, 20)
+    pool.update_from_response(KEY_A, 429, {}, 'text-embedding-3-small')
+
+    report = pool.usage_report()['...11111111']
+    assert (report['requests'], report['tokens'], report['errors']) == (2, 120, 1)
+
+def test_usage_report_labels_are_unique():
+    pool = APIKeyPool(['sk-one-11112222', 'sk-two-11112222'])
+    pool.record_usage('sk-two-11112222', 42)
+    report = pool.usage_report()
+    assert list(report) == ['...11112222', '...11112222#2']
+    assert report['...11112222#2']['tokens'] == 42
@@ -0,0 +1,82 @@
+# test_chat_store.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# size accounting, author bookkeeping and eviction of the chat history store
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from chat_store import ChatStore, AUTHOR_OVERHEAD, CHANNEL_OVERHEAD, message_size
+
+# what a channel's size should be, counted from scratch
+def recount(channel):
+    size = CHANNEL_OVERHEAD + sum(message_size(message) for message in channel.messages)
+    size += AUTHOR_OVERHEAD * len(channel.author_refs)
+    size += sum(sys.getsizeof(name) for name in channel.authors.values())
+    return size
+
+def assert_sizes_match(store):
+    for channel in store.channels.values():
+        assert channel.size == recount(channel)
+    assert store.total_bytes == sum(channel.size for channel in store.channels.values())
+
+def test_size_is_kept_exact_when_the_ring_buffer_drops_turns():
+    store = ChatStore(max_turns=5)
+    for turn in range(50):
+        store.append(1, "user", "x" * (turn % 13 + 1), author_id=100 + turn % 3, display_name=f"User{turn % 3}")
+        store.append(1, "assistant", "y" * (turn % 7 + 1))
+        assert_sizes_match(store)
+    assert len(store.get(1).messages) == 5
+
+def test_renamed_author_is_accounted_once():
+    store = ChatStore(max_turns=10)
+    store.append(1, "user", "hi", author_id=100, display_name="Al")
+    store.append(1, "user", "hello again", author_id=100, display_name="Alexander the Great")
+    assert store.get(1).authors == {100: "Alexander the Great"}
+    assert_sizes_match(store)
+
+def test_authors_are_released_once_their_last_turn_is_dropped():
+    store = ChatStore(max_turns=3)
+    store.append(1, "user", "first", author_id=100, display_name="Old")
+    store.append(1, "user", "second", author_id=200, display_name="New")
+    store.append(1, "user", "third", author_id=100, display_name="Old")
+
+    store.append(1, "assistant", "reply")  # drops "first", but 100 still has "third"
+    assert set(store.get(1).authors) == {100, 200}
+
+    store.append(1, "assistant", "reply")  # drops "second", the last turn of 200
+    assert store.get(1).authors == {100: "Old"}
+    assert store.get(1).author_refs == {100: 1}
+
+    store.append(1, "assistant", "reply")  # drops "third"
+    assert store.get(1).authors == {}
+    assert store.get(1).author_refs == {}
+    assert_sizes_match(store)
+
+def test_least_recently_active_channels_are_evicted_first():
+    store = ChatStore(max_turns=30)
+    for channel_id in (1, 2, 3):
+        store.append(channel_id, "user", "message " * 10, author_id=channel_id, display_name=f"User{channel_id}")
+    channel_size = store.get(1).size
+
+    # room for three channels; touching 1 makes 2 the least recently active
+    store.max_bytes = 3 * channel_size + channel_size // 2
+    store.append(1, "assistant", "ok")
+    store.append(4, "user", "message " * 10, author_id=4, display_name="User4")
+    assert list(store.channels) == [3, 1, 4]
+    assert store.total_bytes <= store.max_bytes
+    assert_sizes_match(store)
+
+def test_most_recent_channel_is_kept_even_over_budget():
+    store = ChatStore(max_turns=30, max_bytes=1)
+    store.append(1, "user", "hello", author_id=1, display_name="User1")
+    store.append(2, "user", "hello", author_id=2, display_name="User2")
+    assert list(store.channels) == [2]
+    assert store.total_bytes == store.get(2).size
+
+def test_empty_content_is_not_stored():
+    store = ChatStore()
+    store.append(1, "assistant", "")
+    assert store.get(1) is None
+    assert store.total_bytes == 0
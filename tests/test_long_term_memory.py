@@ -0,0 +1,145 @@
+# test_long_term_memory.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# long-term memory with the local (hashing) embedding backend
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from long_term_memory import LongTermMemory, HashingEmbeddingBackend
+
+CHANNEL_ID = 1234
+
+TURNS = [
+    "we decided to use postgres for the database",
+    "lunch is pizza on friday",
+    "the deploy is scheduled for monday morning",
+] + [f"random chatter number {i} about cats" for i in range(97)]
+
+# counts the calls so batching can be checked
+class CountingBackend(HashingEmbeddingBackend):
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    async def embed(self, texts):
+        self.calls += 1
+        return await super().embed(texts)
+
+def count_words(text):
+    return len(text.split())
+
+def make_memory(directory, backend=None, **kwargs):
+    kwargs.setdefault('min_score', 0.1)
+    return LongTermMemory(str(directory), backend or HashingEmbeddingBackend(), count_words,
+                          batch_size=32, flush_interval=0.05, **kwargs)
+
+# queue all turns (timestamps 0, 1, 2, ...) and wait until they're stored
+async def remember_turns(memory):
+    memory.start()
+    for timestamp, text in enumerate(TURNS):
+        memory.remember(CHANNEL_ID, text, float(timestamp))
+    await memory.queue.join()
+    memory.worker.cancel()
+
+def test_turns_are_embedded_in_batches(tmp_path):
+    async def run():
+        backend = CountingBackend()
+        memory = make_memory(tmp_path, backend)
+        await remember_turns(memory)
+        assert memory.indexes[CHANNEL_ID].count == len(TURNS)
+        assert backend.calls == 4  # 100 turns in batches of 32
+
+    asyncio.run(run())
+
+def test_recall_finds_relevant_turns_before_cutoff(tmp_path):
+    async def run():
+        memory = make_memory(tmp_path)
+        await remember_turns(memory)
+
+        assert "we decided to use postgres for the database" in await memory.recall(CHANNEL_ID, "which database did we decide on")
+
+        # turns at or after the cutoff are still in the chat history and must not be recalled
+        assert await memory.recall(CHANNEL_ID, "which database did we decide on", before=0.0) == []
+        assert "we decided to use postgres for the database" in await memory.recall(CHANNEL_ID, "which database did we decide on", before=1.0)
+
+        # unknown channels have nothing to recall
+        assert await memory.recall(CHANNEL_ID + 1, "which database") == []
+
+    asyncio.run(run())
+
+def test_recall_respects_token_budget(tmp_path):
+    async def run():
+        memory = make_memory(tmp_path, max_tokens=10)
+        await remember_turns(memory)
+
+        snippets = await memory.recall(CHANNEL_ID, "which database did we decide on")
+        assert snippets
+        assert sum(count_words(snippet) for snippet in snippets) <= 10
+
+    asyncio.run(run())
+
+def test_index_is_reopened_from_disk(tmp_path):
+    async def run():
+        await remember_turns(make_memory(tmp_path))
+
+        reopened = make_memory(tmp_path)
+        assert "lunch is pizza on friday" in await reopened.recall(CHANNEL_ID, "pizza for lunch")
+        assert reopened.indexes[CHANNEL_ID].count == len(TURNS)
+
+    asyncio.run(run())
+
+def test_oldest_turns_are_dropped_past_the_row_cap(tmp_path):
+    async def run():
+        memory = make_memory(tmp_path, max_rows_per_channel=40)
+        await remember_turns(memory)
+
+        index = memory.indexes[CHANNEL_ID]
+        assert 0 < index.count <= 40
+        # the newest rows are kept, in order, and still line up with their texts
+        kept = TURNS[-index.count:]
+        assert index.timestamps[:index.count].tolist() == [float(len(TURNS) - index.count + row) for row in range(index.count)]
+        assert index._read_texts(range(index.count)) == kept
+        assert os.path.getsize(index.texts_path) < sum(len(text) + 3 for text in TURNS)
+
+        assert await memory.recall(CHANNEL_ID, "which database did we decide on") == []
+        assert kept[-1] in await make_memory(tmp_path).recall(CHANNEL_ID, kept[-1])
+
+    asyncio.run(run())
+
+# fails the first `failures` calls, like a rate limited or unreachable API
+class FlakyBackend(CountingBackend):
+
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+
+    async def embed(self, texts):
+        if self.failures:
+            self.failures -= 1
+            self.calls += 1
+            raise RuntimeError("HTTP 429")
+        return await super().embed(texts)
+
+def test_failed_batches_are_retried(tmp_path):
+    async def run():
+        backend = FlakyBackend(failures=3)
+        memory = make_memory(tmp_path, backend, retry_delay=0.01, max_attempts=6)
+        await remember_turns(memory)
+        assert memory.indexes[CHANNEL_ID].count == len(TURNS)
+        assert backend.calls == 4 + 3
+
+    asyncio.run(run())
+
+def test_batches_are_dropped_after_max_attempts(tmp_path):
+    async def run():
+        backend = FlakyBackend(failures=3)
+        memory = make_memory(tmp_path, backend, retry_delay=0.01, max_attempts=3)
+        await remember_turns(memory)
+        # the first batch gave up after three attempts, the other three got through
+        assert memory.indexes[CHANNEL_ID].count == len(TURNS) - 32
+
+    asyncio.run(run())
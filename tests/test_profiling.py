@@ -0,0 +1,47 @@
+# test_profiling.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# slow callback detection on the event loop
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+import os
+import sys
+import time
+import asyncio
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from profiling import SlowCallbackDetector
+
+# block the loop `blocks` times for `seconds` each, with short breaks in between
+async def block_loop(logger, threshold, blocks, seconds):
+    detector = SlowCallbackDetector(asyncio.get_running_loop(), threshold, logger)
+    detector.start()
+    try:
+        for _ in range(blocks):
+            time.sleep(seconds)
+            await asyncio.sleep(0.05)
+    finally:
+        detector.stop()
+
+def overruns(caplog):
+    return [record.args[0] for record in caplog.records if record.msg.startswith("Event loop was blocked")]
+
+def test_every_stall_over_the_threshold_is_logged(caplog):
+    logger = logging.getLogger('test_profiling')
+    with caplog.at_level(logging.WARNING, logger='test_profiling'):
+        asyncio.run(block_loop(logger, threshold=0.1, blocks=10, seconds=0.13))
+
+    blocked = overruns(caplog)
+    assert len(blocked) == 10
+    # measured from when the heartbeat was due, so at most one interval short
+    assert all(0.115 <= seconds < 0.25 for seconds in blocked)
+
+    stacks = [record for record in caplog.records if record.msg.startswith("Event loop blocked")]
+    assert stacks and 'block_loop' in stacks[0].args[2]
+
+def test_short_stalls_are_not_logged(caplog):
+    logger = logging.getLogger('test_profiling')
+    with caplog.at_level(logging.WARNING, logger='test_profiling'):
+        asyncio.run(block_loop(logger, threshold=0.2, blocks=5, seconds=0.05))
+
+    assert overruns(caplog) == []
@@ -28,40 +28,82 @@ MAX_TURNS = 30
 # Desired channel name
 DESIRED_CHANNEL_NAME = "chatkeke"
 
-# Function to append a message to chat_history, ensuring only MAX_TURNS are kept
-def append_to_chat_history(chat_history, role, content):
-    if content:
-        chat_history.append({"role": role, "content": content})
-    # Keep only the latest MAX_TURNS messages in chat history
-    return chat_history[-MAX_TURNS:]
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Early-reject gating pipeline
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Cheap checks that run in order before any formatting, logging or allocation.
+# Each gate returns None to let the message through, or a reply to send
+# before dropping the message ('' = drop silently).
+# The rate limit gate counts the request, so it has to stay last.
+
+# Ignore other bots (and ourselves)
+def gate_author_is_bot(bot, message):
+    return '' if message.author.bot else None
+
+# Only talk in the desired channel (DMs have no channel name)
+def gate_channel_not_allowed(bot, message):
+    return None if getattr(message.channel, 'name', None) == DESIRED_CHANNEL_NAME else ''
+
+# Send a "holiday message" if the bot is on a break
+def gate_bot_disabled(bot, message):
+    return bot.bot_disabled_msg if bot.is_bot_disabled else None
+
+# Daily token budget (GlobalMaxTokenUsagePerDay)
+def gate_over_token_budget(bot, message):
+    if bot.max_tokens_config and bot.is_over_token_budget():
+        return "The bot has reached its daily usage limit. Please try again tomorrow."
+    return None
+
+# Global rate limit (MaxGlobalRequestsPerMinute)
+def gate_rate_limited(bot, message):
+    if bot.check_global_rate_limit():
+        return "The bot is currently busy. Please try again in a minute."
+    return None
+
+MESSAGE_GATES = (
+    gate_author_is_bot,
+    gate_channel_not_allowed,
+    gate_bot_disabled,
+    gate_over_token_budget,
+    gate_rate_limited,
+)
+
+# Run the gates; returns None if the message should be processed
+def gate_message(bot, message):
+    for gate in MESSAGE_GATES:
+        reply = gate(bot, message)
+        if reply is not None:
+            return reply
+    return None
+
+# Show the typing indicator until cancelled; it's only cosmetic,
+# so failing to send it must never hold up or break the reply
+async def show_typing(channel, logger):
+    try:
+        async with channel.typing():
+            await asyncio.get_running_loop().create_future()
+    except Exception as e:
+        logger.debug("Couldn't show the typing indicator: %s", e)
 
 # Discord text message handling logic
 async def handle_message(bot, message, channel_id):
-    # Check if the message is in the desired channel
-    if message.channel.name != DESIRED_CHANNEL_NAME:
-        # If not, do not process the message
+    # Drop (or reject) the message as early and cheaply as possible
+    reply = gate_message(bot, message)
+    if reply is not None:
+        if reply:
+            await message.channel.send(reply)
         return
 
-    # Check and log the type of the message object
-    bot.logger.info(f"Type of message object: {type(message)}")
-
     # Type check for message object
     if not isinstance(message, discord.Message):
-        bot.logger.error(f"Invalid message object type: {type(message)}")
+        bot.logger.error("Invalid message object type: %s", type(message))
         return
 
     # Initialize bot_reply before the for-loop
     bot_reply = None
 
-    # Send a "holiday message" if the bot is on a break
-    if bot.is_bot_disabled:
-        await message.channel.send(bot.bot_disabled_msg)
-        return
-
-    # Check the global rate limit
-    if bot.check_global_rate_limit():
-        await message.channel.send("The bot is currently busy. Please try again in a minute.")
-        return
+    # Show the typing indicator right away, alongside the memory recall and the API request
+    typing_task = asyncio.create_task(show_typing(message.channel, bot.logger))
 
     # Process a text message
     try:
@@ -72,52 +114,50 @@ async def handle_message(bot, message, channel_id):
         display_name = message.author.display_name  # Get the display name of the message author
 
         # Log the received user message
-        bot.logger.info(f"Received message from {message.author.name} in channel {channel_id}: {user_message}")
-
-        # Initialize or update chat history for the channel
-        if channel_id not in bot.chat_history:
-            bot.chat_history[channel_id] = {
-                'last_message_time': datetime.datetime.utcnow(),
-                'messages': []
-            }
+        if bot.logger.isEnabledFor(logging.INFO):
+            bot.logger.info("Received message from %s in channel %s: %s", username, channel_id, user_message)
 
-        chat_history = bot.chat_history[channel_id]['messages']
-
-        # Prepare the system message
-        system_timestamp = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S UTC")
-        day_of_week = datetime.datetime.utcnow().strftime("%A")
+        # Prepare the system message (not stored; rebuilt for every request)
+        now = datetime.datetime.utcnow()
+        system_timestamp = now.strftime("%Y-%m-%d %H:%M:%S UTC")
+        day_of_week = now.strftime("%A")
         system_message = {
             "role": "system",
             "content": f"System time+date: {system_timestamp}, {day_of_week}): {bot.system_instructions}"
         }
 
-        # append_to_chat_history(chat_history, system_message["role"], system_message["content"])
-        # Updating chat history with the system message
-        chat_history = append_to_chat_history(chat_history, system_message["role"], system_message["content"])
-
         # ~~~~~~~~~~~~~~~~~~~~~~~~~
         # The incoming user message
         # ~~~~~~~~~~~~~~~~~~~~~~~~~
-        # Append the user message with the username to the chat history
-        
-        # (without timestamps)
-        # user_message_with_username = f"{display_name} <@{user_id}> says: {user_message}"
-
-        # Format the current time with the configured timezone
-        timestamp = bot.format_datetime(datetime.datetime.now())
-
-        # Append the user message with the username and timestamp to the chat history
-        user_message_with_username= f"[{timestamp}] {display_name} <@{user_id}> says: {user_message}"
-        
-        # user_message_with_username = f"Käyttäjä {display_name} sanoo: {user_message}"
-        logging.info(f"[INFO] {display_name} <@{user_id}> says: {user_message}")
-        # append_to_chat_history(chat_history, "user", user_message_with_username)
-        # Updating chat history with the user message
-        chat_history = append_to_chat_history(chat_history, "user", user_message_with_username)
+        # Store the raw user message along with the author; the
+        # `[timestamp] display_name <@id> says: ...` line is rendered when the prompt is built
+        logging.info("[INFO] %s <@%s> says: %s", display_name, user_id, user_message)
+        bot.chat_store.append(channel_id, "user", user_message, author_id=user_id, display_name=display_name)
+
+        # Build the prompt: system message + the channel's history (incl. the latest user message)
+        chat_history = [system_message] + bot.chat_store.render(channel_id, bot.format_datetime)
+
+        # Long-term memory: add relevant turns that have already left the chat history,
+        # and queue the latest user message for embedding
+        # (messages without text, i.e. images or stickers, aren't stored in the chat history)
+        channel_history = bot.chat_store.get(channel_id)
+        if bot.long_term_memory is not None and user_message and channel_history is not None:
+            window = channel_history.messages
+            memory_message = await bot.long_term_memory.recall_message(channel_id, user_message, before=window[0].timestamp)
+            if memory_message is not None:
+                chat_history.insert(1, memory_message)
+            bot.long_term_memory.remember(channel_id, chat_history[-1]["content"], window[-1].timestamp)
 
         # Attempt to send a reply
         for attempt in range(bot.max_retries):
             try:
+                # Pick the API key with the most rate limit headroom
+                api_key = bot.api_key_pool.acquire(bot.model)
+                if api_key is None:
+                    bot.logger.error("All API keys are in cooldown for another %.0fs.", bot.api_key_pool.seconds_until_available(bot.model))
+                    await message.channel.send("The bot is currently busy. Please try again in a minute.")
+                    break
+
                 # Prepare the payload for the API request
                 payload = {
                     "model": bot.model,
@@ -129,7 +169,7 @@ async def handle_message(bot, message, channel_id):
 
                 headers = {
                     "Content-Type": "application/json",
-                    "Authorization": f"Bearer {openai.api_key}"
+                    "Authorization": f"Bearer {api_key}"
                 }
 
                 async with httpx.AsyncClient() as client:
@@ -139,8 +179,14 @@ async def handle_message(bot, message, channel_id):
                                                  timeout=bot.timeout)
                     response_json = response.json()
 
+                # Track the key's remaining requests/tokens (and cooldown on 429/401)
+                bot.api_key_pool.update_from_response(api_key, response.status_code, response.headers, bot.model)
+
                 # Process the response and extract the bot's reply
                 if response.status_code == 200:
+                    # Add the request's token usage to the daily ledger
+                    bot.record_token_usage(api_key, response_json.get('usage', {}).get('total_tokens', 0))
+
                     bot_reply = response_json['choices'][0]['message']['content'].strip()
 
                     # Format the bot's reply with user mention
@@ -155,17 +201,24 @@ async def handle_message(bot, message, channel_id):
                         bot_reply_formatted = bot_reply
 
                     # Updating chat history with the bot's reply
-                    chat_history = append_to_chat_history(chat_history, "assistant", bot_reply_formatted)
+                    bot.chat_store.append(channel_id, "assistant", bot_reply_formatted)
+                    if bot.long_term_memory is not None and bot_reply_formatted:
+                        bot.long_term_memory.remember(channel_id, f"[{bot.format_datetime(datetime.datetime.now())}] You replied: {bot_reply_formatted}")
 
                     # Log the bot's response
                     # bot.logger.info(f"Bot's reply in channel {channel_id}: {bot_reply}")
                     # await message.channel.send(bot_reply)
                     
                     # Log the bot's response
-                    bot.logger.info(f"Bot's reply in channel {channel_id}: {bot_reply_formatted}")
+                    bot.logger.info("Bot's reply in channel %s: %s", channel_id, bot_reply_formatted)
 
+                    typing_task.cancel()
                     await message.channel.send(bot_reply_formatted)                    
                     break
+                elif response.status_code in (401, 429) and attempt < bot.max_retries - 1:
+                    # Rate limited or rejected key; it's now in cooldown, so retry with another one
+                    bot.logger.warning("API key %s got HTTP %s, retrying with another key.", bot.api_key_pool.get_state(api_key).label, response.status_code)
+                    continue
                 else:
                     bot.logger.error("Received error response from API")
                     await message.channel.send("An error occurred while processing your request. Please try again later.")
@@ -180,14 +233,13 @@ async def handle_message(bot, message, channel_id):
                     break
 
             except Exception as e:
-                bot.logger.error(f"Error during message processing: {e}")
+                bot.logger.error("Error during message processing: %s", e)
                 await message.channel.send("Sorry, there was an error processing your message.")
                 break
 
-        # Update the chat history in the main bot data
-        bot.chat_history[channel_id]['last_message_time'] = datetime.datetime.utcnow()
-        bot.chat_history[channel_id]['messages'] = chat_history
-
     except Exception as e:
         bot.logger.error("Unhandled exception:", exc_info=True)
         await message.channel.send("An unexpected error occurred. Please try again.")
+
+    finally:
+        typing_task.cancel()